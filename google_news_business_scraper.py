@@ -1,17 +1,26 @@
 import requests
-import pandas as pd
-from bs4 import BeautifulSoup
+import httpx
+from lxml import etree
+import lxml.html
 import asyncio
-from playwright.async_api import async_playwright
-import json
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+import orjson
 from datetime import datetime, timedelta, timezone
 from dateutil import parser as date_parser
+from email.utils import parsedate_to_datetime
 import sys
+import logging
 import time
 import re
-from isin import extract_company_simple
-from isin_matcher import get_isin_for_company
-from prompts import summarize_multiple_articles, print_summary_results
+import base64
+import sqlite3
+import hashlib
+from collections import defaultdict
+from functools import lru_cache
+from urllib.parse import urlparse
+from isin import extract_companies_batch
+from isin_matcher import cached_isin_batch, find_company_in_title
+from prompts import summarize_multiple_articles_async, print_summary_results
 import os
 from dotenv import load_dotenv
 
@@ -24,66 +33,158 @@ if sys.platform == 'win32':
         pass
 
 
+# One stdout handler for the scraping hot path (RSS fetch, scrape loop) instead of bare print
+logger = logging.getLogger('scraper')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
 MIN_ARTICLE_LENGTH = 200
+PROCESSED_DB = 'processed.db'
+RSS_URL = "https://news.google.com/rss/topics/CAAqJggKIiBDQkFTRWdvSUwyMHZNRGx6TVdZU0FtVnVHZ0pWVXlnQVAB?hl=en-IN&gl=IN&ceid=IN:en"
+SLACK_MAX_BYTES = 38000  # Slack truncates message text at 40k chars
+AI_BATCH_SIZE = 10  # Articles per batched Gemini company-extraction call
+DOMAIN_DELAY_MS = 500  # Minimum gap between requests to the same domain
+MAX_PARALLEL = 5  # Stories scraped concurrently (also the page pool size)
+BLOCKED_RESOURCE_TYPES = frozenset({'image', 'media', 'font', 'stylesheet'})
+CLEAR_COOKIES_EVERY = 20  # Clear the shared context's cookies every N stories
+_HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+_GNEWS_URL_RE = re.compile(rb'https?://[\x21-\x7e]+')
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
-def fetch_business_news_rss(processed_articles):
-    """Fetch top business news from Google News RSS feed, filtering out already processed articles"""
-    print("=" * 70)
-    print("📰 Google News Business Section Scraper (RSS Method)")
-    print("=" * 70)
-    
-    print("\n📡 Fetching Google News Business RSS feed...")
+# Kept alive across iterations so the feed request reuses its connection
+_rss_session = requests.Session()
+
+def article_key(title, source):
+    """64-bit FNV-1a hash of title + source, stored as a signed SQLite INTEGER"""
+    h = 0xcbf29ce484222325
+    for b in (title + '\x1f' + source).encode('utf-8'):
+        h = ((h ^ b) * 0x100000001b3) & 0xFFFFFFFFFFFFFFFF
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+def open_processed_db(path=PROCESSED_DB):
+    """Open (or create) the SQLite store of already-processed article keys"""
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE IF NOT EXISTS seen(h INTEGER PRIMARY KEY)')
+    conn.execute('CREATE TABLE IF NOT EXISTS seen_content(h INTEGER PRIMARY KEY)')
+    conn.execute('CREATE TABLE IF NOT EXISTS feed_state(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)')
+    conn.commit()
+    return conn
+
+def is_processed(conn, key):
+    return conn.execute('SELECT 1 FROM seen WHERE h=?', (key,)).fetchone() is not None
+
+def mark_processed(conn, keys):
+    conn.executemany('INSERT OR IGNORE INTO seen(h) VALUES (?)', [(k,) for k in keys])
+    conn.commit()
+
+def content_hash(full_article):
+    """blake2b-64 of the first 2KB of article text, as a signed SQLite INTEGER"""
+    digest = hashlib.blake2b(full_article[:2048].encode('utf-8', 'ignore'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def is_content_seen(conn, h):
+    return conn.execute('SELECT 1 FROM seen_content WHERE h=?', (h,)).fetchone() is not None
+
+def mark_content_seen(conn, hashes):
+    conn.executemany('INSERT OR IGNORE INTO seen_content(h) VALUES (?)', [(h,) for h in hashes])
+    conn.commit()
+
+def load_feed_state(conn, url):
+    """Return the (etag, last_modified) validators saved for a feed, or (None, None)"""
+    row = conn.execute('SELECT etag, last_modified FROM feed_state WHERE url=?', (url,)).fetchone()
+    return row if row else (None, None)
+
+def save_feed_state(conn, url, etag, last_modified):
+    conn.execute('INSERT OR REPLACE INTO feed_state(url, etag, last_modified) VALUES (?, ?, ?)', (url, etag, last_modified))
+    conn.commit()
+
+def clear_feed_state(conn):
+    """Forget feed validators so the next fetch is unconditional (e.g. after a failed iteration)"""
+    conn.execute('DELETE FROM feed_state')
+    conn.commit()
+
+def count_processed(conn):
+    return conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+def fetch_business_news_rss(processed_db):
+    """Fetch top business news from Google News RSS feed, filtering out already processed articles.
+    Returns (articles, feed validators): the (etag, last_modified) pair is only saved by the
+    caller once the articles have been processed, and is None for a 304 or a failed fetch/parse."""
+    logger.info("=" * 70)
+    logger.info("📰 Google News Business Section Scraper (RSS Method)")
+    logger.info("=" * 70)
     
+    logger.info("\n📡 Fetching Google News Business RSS feed...")
     
-    rss_url = "https://news.google.com/rss/topics/CAAqJggKIiBDQkFTRWdvSUwyMHZNRGx6TVdZU0FtVnVHZ0pWVXlnQVAB?hl=en-IN&gl=IN&ceid=IN:en"
     
     try:
-        resp = requests.get(rss_url, timeout=10)
-        resp.raise_for_status()
+        # Conditional GET: an unchanged feed comes back as an empty 304
+        etag, last_modified = load_feed_state(processed_db, RSS_URL)
+        headers = {'Accept-Encoding': 'gzip'}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        resp = _rss_session.get(RSS_URL, timeout=10, headers=headers)
+        
+        if resp.status_code == 304:
+            logger.info("✅ RSS feed unchanged since last fetch (304 Not Modified)")
+            return [], None
         
-        # Parse RSS XML
-        soup = BeautifulSoup(resp.content, 'xml')
-        items = soup.find_all('item')
+        resp.raise_for_status()
+        validators = (resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
         
-        print(f"✅ Found {len(items)} news items in RSS feed")
+        # Parse RSS XML; items are streamed straight off the tree below
+        root = etree.fromstring(resp.content)
         
         articles_data = []
         skipped_count = 0
         
       
-        current_time = datetime.now()
+        # Compare in tz-aware UTC so RSS timestamps need no conversion
+        current_time = datetime.now(timezone.utc)
         time_window_minutes = 1440  # 24 hours - matches RSS feed, dedup handles rest
         cutoff_time = current_time - timedelta(minutes=time_window_minutes)
         
-        print(f"⏰ Filtering articles from last {time_window_minutes} minutes")
-        print(f"   Cutoff time: {cutoff_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        logger.info(f"⏰ Filtering articles from last {time_window_minutes} minutes")
+        logger.info(f"   Cutoff time: {cutoff_time.astimezone().strftime('%Y-%m-%d %H:%M:%S')}")
         
         time_filtered_count = 0
         
         parse_errors = 0
+        total_items = 0
         
-        for idx, item in enumerate(items):  # Process ALL items, no [:10] limit
+        for idx, item in enumerate(root.iter('item')):  # Process ALL items, no [:10] limit
+            total_items += 1
             try:
-                title = item.find('title').get_text() if item.find('title') else "No Title"
-                link = item.find('link').get_text() if item.find('link') else None
-                pub_date = item.find('pubDate').get_text() if item.find('pubDate') else "Unknown"
+                title = item.findtext('title') or "No Title"
+                link = item.findtext('link') or None
+                pub_date = item.findtext('pubDate') or "Unknown"
                 source_elem = item.find('source')
-                source = source_elem.get_text() if source_elem else "Unknown"
+                source = (source_elem.text if source_elem is not None else None) or "Unknown"
                 
                 if link:
                 
                     date_parse_failed = False
                     try:
-                        article_time = date_parser.parse(pub_date)
-                 
-                        if article_time.tzinfo is not None:
-                            article_time = article_time.replace(tzinfo=None)
+                        # RSS pubDate is RFC 822, no need for dateutil's format sniffing
+                        article_time = parsedate_to_datetime(pub_date)
+                        
+                        # "-0000" offsets parse as naive; RFC 5322 treats them as UTC
+                        if article_time.tzinfo is None:
+                            article_time = article_time.replace(tzinfo=timezone.utc)
                         
                      
                         if idx < 3:
-                            print(f"   [DEBUG] Article {idx+1}: {title[:50]}...")
-                            print(f"           Published: {article_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                            print(f"           Age: {(current_time - article_time).total_seconds()/3600:.1f} hours old")
+                            logger.info(f"   [DEBUG] Article {idx+1}: {title[:50]}...")
+                            logger.info(f"           Published: {article_time.astimezone().strftime('%Y-%m-%d %H:%M:%S')}")
+                            logger.info(f"           Age: {(current_time - article_time).total_seconds()/3600:.1f} hours old")
                         
                         # Skip articles older than cutoff time
                         if article_time < cutoff_time:
@@ -94,13 +195,13 @@ def fetch_business_news_rss(processed_articles):
                         date_parse_failed = True
                         parse_errors += 1
                         if idx < 3:
-                            print(f"   [DEBUG] Article {idx+1}: Could not parse date '{pub_date}'")
+                            logger.info(f"   [DEBUG] Article {idx+1}: Could not parse date '{pub_date}'")
                     
                     # Create unique identifier for article
-                    article_id = (title, source)
+                    article_id = article_key(title, source)
                     
     
-                    if article_id in processed_articles:
+                    if is_processed(processed_db, article_id):
                         skipped_count += 1
                         continue
                     
@@ -116,60 +217,130 @@ def fetch_business_news_rss(processed_articles):
             except Exception as e:
                 continue
         
+        logger.info(f"✅ Found {total_items} news items in RSS feed")
+        
         if parse_errors > 0:
-            print(f"⚠️  Warning: Could not parse date for {parse_errors} article(s) (included anyway)")
+            logger.info(f"⚠️  Warning: Could not parse date for {parse_errors} article(s) (included anyway)")
         
         if time_filtered_count > 0:
-            print(f"⏰ Filtered out {time_filtered_count} article(s) older than {time_window_minutes} minutes")
+            logger.info(f"⏰ Filtered out {time_filtered_count} article(s) older than {time_window_minutes} minutes")
         
         if skipped_count > 0:
-            print(f"⏭️  Skipped {skipped_count} already-processed article(s)")
+            logger.info(f"⏭️  Skipped {skipped_count} already-processed article(s)")
         
-        print(f"\n📊 FILTERING SUMMARY:")
-        print(f"   Total RSS items: {len(items)}")
-        print(f"   Filtered by time: {time_filtered_count}")
-        print(f"   Already processed: {skipped_count}")
-        print(f"   Parse errors: {parse_errors}")
-        print(f"   ✅ NEW articles to scrape: {len(articles_data)}")
+        logger.info(f"\n📊 FILTERING SUMMARY:")
+        logger.info(f"   Total RSS items: {total_items}")
+        logger.info(f"   Filtered by time: {time_filtered_count}")
+        logger.info(f"   Already processed: {skipped_count}")
+        logger.info(f"   Parse errors: {parse_errors}")
+        logger.info(f"   ✅ NEW articles to scrape: {len(articles_data)}")
         
-        return articles_data
+        return articles_data, validators
         
     except Exception as e:
-        print(f"❌ Error fetching RSS feed: {e}")
-        return []
+        logger.info(f"❌ Error fetching RSS feed: {e}")
+        return [], None
+
+@lru_cache(maxsize=2048)
+def _domain(url):
+    return urlparse(url).netloc.removeprefix('www.')
+
+def _is_google_url(url):
+    """True for any google.com host (news, consent and sign-in interstitials), never an article"""
+    host = (urlparse(url).hostname or '').lower()
+    return host == 'google.com' or host.endswith('.google.com')
+
+def _decode_gnews(google_url):
+    """Decode the target URL embedded in a news.google.com/rss/articles/<id> link.
+    The id is a base64-encoded protobuf that carries the source URL as an ASCII substring."""
+    path = urlparse(google_url).path
+    if '/articles/' not in path:
+        return None
+    
+    article_id = path.split('/articles/', 1)[1].split('/')[0]
+    try:
+        raw = base64.urlsafe_b64decode(article_id + '=' * (-len(article_id) % 4))
+    except Exception:
+        return None
+    
+    match = _GNEWS_URL_RE.search(raw)
+    return [match.group().decode('ascii')] if match else None
+
+async def _wait_for_redirect(page, timeout=10000):
+    """Wait until the page has left Google (the JS redirect to the source) or give up"""
+    try:
+        await page.wait_for_url(lambda u: not _is_google_url(u), timeout=timeout)
+    except PlaywrightTimeoutError:
+        pass
 
-async def get_story_url(page, google_news_url):
-    """Follow Google News RSS link - it will redirect to the actual article source"""
+async def get_story_url(client, page, google_news_url):
+    """Resolve a Google News RSS link to the actual article source.
+    Tries a plain HTTP redirect first, then decoding the article id, then a browser navigation."""
+    try:
+        r = await client.get(google_news_url, follow_redirects=True, timeout=10, headers={"User-Agent": USER_AGENT})
+        if not _is_google_url(str(r.url)):
+            return [str(r.url)]
+    except Exception:
+        pass
+    
+    decoded = _decode_gnews(google_news_url)
+    if decoded:
+        return decoded
+    
+    # Fall back to following the redirect in the browser
     try:
-  
         await page.goto(google_news_url, wait_until="domcontentloaded", timeout=20000)
-        await asyncio.sleep(2)
+        await _wait_for_redirect(page)
         
-       
-        return [page.url] if page.url else None
+        return [page.url] if page.url and not _is_google_url(page.url) else None
         
     except Exception as e:
-        print(f"         ❌ Error: {str(e)[:60]}...")
+        logger.info(f"         ❌ Error: {str(e)[:60]}...")
+        return None
+
+def extract_article_text(html):
+    """Extract the article body text (paragraphs longer than 30 chars) from raw HTML"""
+    if not html:
+        return ""
+    
+    # Encode explicitly: lxml rejects str input that carries an XML encoding declaration
+    try:
+        tree = lxml.html.fromstring(html.encode('utf-8'), parser=_HTML_PARSER)
+    except (etree.ParserError, ValueError):
+        # Whitespace- or comment-only bodies ("Document is empty")
+        return ""
+    
+    # Remove unwanted elements (from rs.py approach)
+    etree.strip_elements(tree, 'script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe', with_tail=False)
+    
+    # Extract paragraphs (from test2.py approach), letting XPath do the length filter
+    paragraphs = tree.xpath('//p[string-length(normalize-space()) > 30]')
+    text = " ".join(p.text_content().strip() for p in paragraphs)
+    return text.strip()
+
+async def fetch_static(url, client):
+    """Fetch raw HTML over plain HTTP (no JS). Returns None on any failure"""
+    try:
+        r = await client.get(url, timeout=15, follow_redirects=True, headers={"User-Agent": USER_AGENT})
+        return r.text if r.status_code == 200 else None
+    except Exception:
         return None
 
 async def scrape_article_content(url, page):
     """Scrape full article text from a URL using Playwright"""
     try:
         await page.goto(url, timeout=120000, wait_until="domcontentloaded")
-        await asyncio.sleep(2)
-        
-        content = await page.content()
-        soup = BeautifulSoup(content, "html.parser")
         
-        # Remove unwanted elements (from rs.py approach)
-        for element in soup.find_all(['script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe']):
-            element.decompose()
+        # Wait for article paragraphs rather than a fixed delay
+        try:
+            await page.wait_for_selector('p', timeout=3000)
+        except PlaywrightTimeoutError:
+            pass
         
-        # Extract paragraphs (from test2.py approach)
-        paragraphs = soup.find_all("p")
-        text = " ".join([p.get_text().strip() for p in paragraphs if len(p.get_text().strip()) > 30])
+        content = await page.content()
+        text = extract_article_text(content)
         
-        return text.strip() if text else "NO_CONTENT"
+        return text if text else "NO_CONTENT"
         
     except Exception as e:
         return f"ERROR: {str(e)[:100]}"
@@ -178,7 +349,7 @@ async def resolve_google_news_url(page, google_url):
     """Resolve a Google News article URL to the actual source URL"""
     try:
         await page.goto(google_url, wait_until="domcontentloaded", timeout=20000)
-        await asyncio.sleep(2)
+        await _wait_for_redirect(page)
         
         final_url = page.url
         
@@ -200,97 +371,215 @@ async def resolve_google_news_url(page, google_url):
     except:
         return None
 
-async def scrape_all_articles(articles):
-    """Scrape full content from all article URLs using Playwright"""
-    if not articles:
-        print("⚠️  No articles to scrape")
-        return []
+class DomainLimiter:
+    """Space out requests to the same domain by at least delay_ms, while different domains run in parallel"""
     
-    print(f"\n📰 Starting to scrape {len(articles)} stories...\n")
+    def __init__(self, delay_ms=500):
+        self._last = {}
+        self._locks = defaultdict(asyncio.Lock)
+        self._delay = delay_ms / 1000
     
-    async with async_playwright() as p:
-        # Launch browser
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        )
-        page = await context.new_page()
+    async def wait(self, domain):
+        async with self._locks[domain]:
+            sleep = self._last.get(domain, 0) + self._delay - time.monotonic()
+            if sleep > 0:
+                await asyncio.sleep(sleep)
+            self._last[domain] = time.monotonic()
+
+async def _block_heavy_resources(route):
+    """Route handler: only the HTML text matters, so skip images, media, fonts and CSS"""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def create_page_pool(context, size):
+    """Pre-create `size` pages in one context and hand them out through a queue"""
+    pool = asyncio.Queue()
+    for _ in range(size):
+        pool.put_nowait(await context.new_page())
+    return pool
+
+async def scrape_story(client, pool, limiter, article, i, total, processed_db, seen_hashes):
+    """Scrape a single story on a page borrowed from the shared page pool.
+    Articles whose content was already seen (this run or a previous one) are dropped.
+    Progress lines are buffered and logged in one block so parallel stories don't interleave."""
+    lines = []
+    page = await pool.get()
+    try:
+        google_news_url = article['link']
+        title = article['title']
+        
+        lines.append(f"   [{i}/{total}] Processing Story: {article['source']}")
+        lines.append(f"      Title: {title[:60]}...")
+        
+        # Get article URL from RSS (will redirect to source)
+        story_urls = []
+        if 'news.google.com' in google_news_url:
+            lines.append(f"      🔗 Following RSS redirect to source...")
+            await limiter.wait(_domain(google_news_url))
+            story_urls = await get_story_url(client, page, google_news_url)
+            
+            if story_urls:
+                lines.append(f"      ✅ Found article: {story_urls[0][:60]}...")
+            else:
+                lines.append(f"      ⚠️  Could not get article URL, skipping story...")
+                return []
+        else:
+            # Direct URL, not a Google News link
+            story_urls = [google_news_url]
+            lines.append(f"      Direct article URL: {google_news_url[:70]}...")
         
-        scraped_articles = []
+        scraped = []
         
-        for i, article in enumerate(articles, 1):
-            google_news_url = article['link']
-            title = article['title']
+        # Scrape all articles for this story
+        for url_idx, url in enumerate(story_urls, 1):
+            lines.append(f"      📄 Article {url_idx}/{len(story_urls)}: Scraping content...")
             
-            print(f"   [{i}/{len(articles)}] Processing Story: {article['source']}")
-            print(f"      Title: {title[:60]}...")
+            # Fast path: plain HTTP fetch, most news sites render <p> tags server-side
+            await limiter.wait(_domain(url))
+            html = await fetch_static(url, client)
+            full_article = extract_article_text(html) if html else ""
             
-            # Get article URL from RSS (will redirect to source)
-            story_urls = []
-            if 'news.google.com' in google_news_url:
-                print(f"      🔗 Following RSS redirect to source...")
-                story_urls = await get_story_url(page, google_news_url)
-                
-                if story_urls:
-                    print(f"      ✅ Found article: {story_urls[0][:60]}...")
-                else:
-                    print(f"      ⚠️  Could not get article URL, skipping story...\n")
+            # Fall back to a full browser render for JS-heavy pages
+            if len(full_article) < MIN_ARTICLE_LENGTH:
+                lines.append(f"         🌐 Static fetch too short, rendering with browser...")
+                await limiter.wait(_domain(url))
+                full_article = await scrape_article_content(url, page)
+            article_length = len(full_article) if not full_article.startswith("ERROR") and not full_article.startswith("NO_CONTENT") else 0
+            
+            # Extract domain from URL
+            domain = _domain(url)
+            
+            # Skip syndicated copies of a story before spending an AI call on them
+            if article_length > MIN_ARTICLE_LENGTH:
+                h = content_hash(full_article)
+                if h in seen_hashes or is_content_seen(processed_db, h):
+                    lines.append(f"         ⏭️  Duplicate content, skipping")
                     continue
+                seen_hashes.add(h)
+                article.setdefault('content_hashes', []).append(h)
+            
+            scraped.append({
+                "title": title,
+                "source": article['source'],
+                "domain": domain,
+                "url": url,
+                "pub_date": article['pub_date'],
+                "full_article": full_article,
+                "article_length": article_length,
+                "company_name": "",  # Filled in by the batched AI step in scrape_all_articles
+                "scraped_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "story_index": i,
+                "article_index": url_idx
+            })
+            
+            if article_length > 0:
+                lines.append(f"         ✅ Scraped {article_length} characters")
             else:
-                # Direct URL, not a Google News link
-                story_urls = [google_news_url]
-                print(f"      Direct article URL: {google_news_url[:70]}...")
+                lines.append(f"         ⚠️  Failed to scrape content")
+        
+        return scraped
+    finally:
+        # Return the page first: a page lost from the pool would leave later pool.get() calls waiting forever
+        pool.put_nowait(page)
+        logger.info("\n".join(lines) + "\n")
+        # Long-lived pages accumulate cookies/storage; reset periodically
+        if i % CLEAR_COOKIES_EVERY == 0:
+            try:
+                await page.context.clear_cookies()
+            except Exception as e:
+                logger.info(f"         ⚠️  Could not clear cookies: {str(e)[:60]}")
+
+async def start_browser():
+    """Start Playwright and launch Chromium once; the browser is reused across iterations"""
+    playwright = await async_playwright().start()
+    browser = await playwright.chromium.launch(headless=True)
+    return playwright, browser
+
+async def stop_browser(playwright, browser):
+    """Close the long-lived browser and Playwright driver"""
+    try:
+        await browser.close()
+    except Exception:
+        pass
+    await playwright.stop()
+
+async def scrape_all_articles(articles, processed_db, browser):
+    """Scrape full content from all article URLs using a pre-launched browser, MAX_PARALLEL stories at a time"""
+    if not articles:
+        logger.info("⚠️  No articles to scrape")
+        return []
+    
+    logger.info(f"\n📰 Starting to scrape {len(articles)} stories ({MAX_PARALLEL} in parallel)...\n")
+    
+    limits = httpx.Limits(max_connections=20)
+    async with httpx.AsyncClient(http2=True, limits=limits) as client:
+        # Fresh context per iteration (browser is used for Google News redirects and JS-rendered pages)
+        context = await browser.new_context(user_agent=USER_AGENT)
+        try:
+            await context.route('**/*', _block_heavy_resources)
+            pool = await create_page_pool(context, MAX_PARALLEL)
             
-            # Scrape all articles for this story
-            for url_idx, url in enumerate(story_urls, 1):
-                print(f"      📄 Article {url_idx}/{len(story_urls)}: Scraping content...")
-                
-                # Scrape the article content
-                full_article = await scrape_article_content(url, page)
-                article_length = len(full_article) if not full_article.startswith("ERROR") and not full_article.startswith("NO_CONTENT") else 0
-                
-                # Extract domain from URL
-                from urllib.parse import urlparse
-                domain = urlparse(url).netloc.replace('www.', '')
-                
-                # Extract company name using Gemini AI
-                company_name = ""
-                if article_length > MIN_ARTICLE_LENGTH:
-                    print(f"         🤖 Extracting company name with AI...")
-                    company_name = extract_company_simple(full_article, title)
-                    if company_name:
-                        print(f"         ✅ Company: {company_name}")
-                    else:
-                        print(f"         ⚠️  No company identified")
-                
-                scraped_articles.append({
-                    "title": title,
-                    "source": article['source'],
-                    "domain": domain,
-                    "url": url,
-                    "pub_date": article['pub_date'],
-                    "full_article": full_article,
-                    "article_length": article_length,
-                    "company_name": company_name,
-                    "scraped_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "story_index": i,
-                    "article_index": url_idx
-                })
-                
-                if article_length > 0:
-                    print(f"         ✅ Scraped {article_length} characters")
-                else:
-                    print(f"         ⚠️  Failed to scrape content")
-                
-                # Small delay between requests
-                await asyncio.sleep(1)
+            limiter = DomainLimiter(DOMAIN_DELAY_MS)
+            seen_hashes = set()
             
-            print()  # Blank line between stories
+            # The pool doubles as the concurrency gate: at most MAX_PARALLEL stories hold a page
+            results = await asyncio.gather(
+                *[scrape_story(client, pool, limiter, article, i, len(articles), processed_db, seen_hashes) for i, article in enumerate(articles, 1)],
+                return_exceptions=True
+            )
+        finally:
+            # The browser outlives iterations, so a context left open here would leak
+            await context.close()
         
-        await browser.close()
-        print(f"📊 Total articles scraped: {len(scraped_articles)}")
+        scraped_articles = []
+        for article, result in zip(articles, results):
+            if isinstance(result, Exception):
+                logger.info(f"   ❌ Error scraping '{article['title'][:50]}': {str(result)[:60]}...")
+                continue
+            scraped_articles.extend(result)
+        
+        logger.info(f"📊 Total articles scraped: {len(scraped_articles)}")
+        
+        await extract_companies(scraped_articles)
         return scraped_articles
 
+async def extract_companies(scraped_articles):
+    """Fill in company_name for every usable article.
+    Headlines that name a known company verbatim are resolved locally; the rest go to
+    Gemini, AI_BATCH_SIZE articles per call."""
+    eligible = [a for a in scraped_articles if a["article_length"] > MIN_ARTICLE_LENGTH]
+    if not eligible:
+        return
+    
+    needs_ai = []
+    for article in eligible:
+        # Only the headline is trusted for a local match; body text mentions too many
+        # companies in passing
+        company_name = find_company_in_title(article["title"])
+        if company_name:
+            article["company_name"] = company_name
+            logger.info(f"   ✅ {article['title'][:50]}... → {company_name} (local match)")
+        else:
+            needs_ai.append(article)
+    
+    if not needs_ai:
+        return
+    
+    eligible = needs_ai
+    logger.info(f"\n🤖 Extracting company names with AI for {len(eligible)} article(s)...")
+    for start in range(0, len(eligible), AI_BATCH_SIZE):
+        batch = eligible[start:start + AI_BATCH_SIZE]
+        # Run the blocking SDK call off the event loop so the browser connection stays serviced
+        companies = await asyncio.to_thread(extract_companies_batch, batch)
+        for article, company_name in zip(batch, companies):
+            article["company_name"] = company_name
+            if company_name:
+                logger.info(f"   ✅ {article['title'][:50]}... → {company_name}")
+            else:
+                logger.info(f"   ⚠️  {article['title'][:50]}... → No company identified")
+
 def print_json_results(articles):
     """Print articles in JSON format: source -> full article"""
     if not articles:
@@ -314,21 +603,15 @@ def print_json_results(articles):
         return
     
     # Group articles by story
-    stories = {}
-    for article in valid_articles:
-        story_idx = article.get("story_index", 1)
-        if story_idx not in stories:
-            stories[story_idx] = []
-        stories[story_idx].append(article)
-    
+    stories = defaultdict(list)
     # Collect unique companies
-    companies_found = {}
+    companies_found = defaultdict(list)
     
     for article in valid_articles:
+        stories[article.get("story_index", 1)].append(article)
+        
         company = article.get("company_name", "")
         if company:
-            if company not in companies_found:
-                companies_found[company] = []
             companies_found[company].append({
                 "source": article.get("domain", article["source"]),
                 "title": article["title"]
@@ -376,7 +659,7 @@ def print_json_results(articles):
     
     print("\n" + "=" * 70)
     print("📄 FULL RESULTS (JSON):")
-    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
     
     # Print statistics
     print("\n" + "=" * 70)
@@ -391,29 +674,42 @@ def print_json_results(articles):
     print(f"   Total content: {total_chars:,} characters")
     print("=" * 70)
 
+def _chunk_slack_messages(messages, max_bytes=SLACK_MAX_BYTES):
+    """Join messages into as few payloads as possible, each under Slack's size limit"""
+    chunks = []
+    current = []
+    size = 0
+    for m in messages:
+        n = len(m.encode('utf-8')) + 2  # + separator
+        if current and size + n > max_bytes:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(m)
+        size += n
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
 def send_slack_message(message):
     slack_url=os.getenv("SLACK_URL")
 
     if(slack_url):
-        # If a list is provided, send one Slack message per item
+        # If a list is provided, batch the items into as few Slack messages as fit
         if isinstance(message, list):
-            for idx, item in enumerate([m for m in message if m and isinstance(m, str)], 1):
-                payload = {"text": item}
-                response = requests.post(slack_url, json=payload)
+            chunks = _chunk_slack_messages([m for m in message if m and isinstance(m, str)])
+        else:
+            chunks = [str(message)]
+
+        # One session so multiple chunks share the TLS connection
+        with requests.Session() as session:
+            for idx, text in enumerate(chunks, 1):
+                payload = {"text": text}
+                response = session.post(slack_url, json=payload)
                 if response.status_code==200:
-                    print(f"Slack message {idx} sent successfully")
+                    print(f"Slack message {idx}/{len(chunks)} sent successfully")
                 else:
-                    print(f"Failed to send Slack message {idx}: {response.status_code}")
+                    print(f"Failed to send Slack message {idx}/{len(chunks)}: {response.status_code}")
                     print(f"Error: {response.text}")
-        else:
-            text = str(message)
-            payload = {"text": text}
-            response = requests.post(slack_url, json=payload)
-            if response.status_code==200:
-                print("Slack message sent successfully")
-            else:
-                print(f"Failed to send Slack message: {response.status_code}")
-                print(f"Error: {response.text}")
 
     else:
         print("SLACK_URL not found in .env file")
@@ -479,16 +775,18 @@ def format_slack_message_from_article(article: dict) -> str:
     message += "\n------------------------------"
     return message
 
-async def main(processed_articles_set):
+async def main(processed_db, browser):
+    """Run one iteration. Returns (articles to mark as processed, feed validators to save);
+    the validators are None whenever the feed must be fetched unconditionally next time"""
     # Fetch business news from RSS (filtering out already processed articles)
-    articles = fetch_business_news_rss(processed_articles_set)
+    articles, feed_validators = fetch_business_news_rss(processed_db)
     
     if not articles:
         print("\n⚠️  No new articles found in RSS feed.")
-        return []
+        return [], feed_validators
     
     # Scrape full content from each article
-    scraped_articles = await scrape_all_articles(articles)
+    scraped_articles = await scrape_all_articles(articles, processed_db, browser)
     
     if scraped_articles:
         # Print results in JSON format
@@ -501,12 +799,10 @@ async def main(processed_articles_set):
         print("=" * 70)
         
         # Collect unique companies and map them to articles
-        company_to_articles = {}
+        company_to_articles = defaultdict(list)
         for article in scraped_articles:
             company = article.get("company_name", "")
             if company:
-                if company not in company_to_articles:
-                    company_to_articles[company] = []
                 company_to_articles[company].append(article)
         
         if company_to_articles:
@@ -516,9 +812,12 @@ async def main(processed_articles_set):
             articles_with_isin = []
             all_matches = {}
             
+            # Match every company in one batched call (cache hits skip fuzzy matching)
+            isin_matches = cached_isin_batch(list(company_to_articles), top_n=3, min_score=70)
+            
             for company, company_articles in company_to_articles.items():
                 print(f"🔎 Searching ISIN for: {company}")
-                matches = get_isin_for_company(company, top_n=3, min_score=70)
+                matches = isin_matches.get(company, [])
                 
                 if matches:
                     all_matches[company] = matches
@@ -545,7 +844,7 @@ async def main(processed_articles_set):
                 print("=" * 70)
                 print("📋 ISIN MATCHES SUMMARY (JSON):")
                 print("=" * 70)
-                print(json.dumps(all_matches, indent=2, ensure_ascii=False))
+                print(orjson.dumps(all_matches, option=orjson.OPT_INDENT_2).decode())
                 print("=" * 70)
             
             # STEP 2: Summarize ONLY articles with valid ISIN matches
@@ -554,7 +853,7 @@ async def main(processed_articles_set):
                 print(f"🤖 STEP 2: AI ANALYSIS FOR {len(articles_with_isin)} ARTICLES WITH ISIN")
                 print("=" * 70)
                 
-                articles_with_summaries = summarize_multiple_articles(articles_with_isin)
+                articles_with_summaries = await summarize_multiple_articles_async(articles_with_isin)
                 if articles_with_summaries:
                     print_summary_results(articles_with_summaries)
 
@@ -578,17 +877,23 @@ async def main(processed_articles_set):
             print("\n⚠️  No companies identified in articles")
         
         # Return articles to be marked as processed by caller
-        return articles
+        return articles, feed_validators
     else:
+        # Keep the old validators so these articles are fetched again next iteration
         print("\n⚠️  No articles were scraped.")
-        return []
+        return [], None
 
 if __name__ == "__main__":
     iteration = 0
     INTERVAL_MINUTES = 30  # Run every 30 minutes (from start of iteration)
     
    
-    processed_articles = set()  # Set of (title, source) tuples
+    processed_db = open_processed_db()  # Hashed (title, source) keys, persisted across restarts
+    
+    # One event loop and one Playwright/Chromium instance for the lifetime of the process
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    playwright, browser = loop.run_until_complete(start_browser())
     
     print("\n" + "🔄" * 35)
     print("🤖 CONTINUOUS NEWS SCRAPER STARTED")
@@ -604,20 +909,28 @@ if __name__ == "__main__":
         print("\n" + "🚀" * 35)
         print(f"🔄 ITERATION #{iteration}")
         print(f"🕐 Started at: {iteration_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"📚 Total processed articles: {len(processed_articles)}")
+        print(f"📚 Total processed articles: {count_processed(processed_db)}")
         print("🚀" * 35 + "\n")
         
         try:
+            # Relaunch if Chromium died since the last iteration
+            if not browser.is_connected():
+                loop.run_until_complete(stop_browser(playwright, browser))
+                playwright, browser = loop.run_until_complete(start_browser())
+            
             # Run the main scraping function with processed articles tracker
-            processed_articles_list = asyncio.run(main(processed_articles))
+            processed_articles_list, feed_validators = loop.run_until_complete(main(processed_db, browser))
             
             # Mark articles as processed permanently
             if processed_articles_list:
-                for article in processed_articles_list:
-                    if 'article_id' in article:
-                        processed_articles.add(article['article_id'])
+                mark_processed(processed_db, [a['article_id'] for a in processed_articles_list if 'article_id' in a])
+                mark_content_seen(processed_db, [h for a in processed_articles_list for h in a.get('content_hashes', [])])
                 print(f"\n✅ Marked {len(processed_articles_list)} article(s) as processed permanently")
             
+            # Only now may the next fetch be conditional: a 304 must never hide unprocessed articles
+            if feed_validators:
+                save_feed_state(processed_db, RSS_URL, *feed_validators)
+            
             end_time = datetime.now()
             duration = (end_time - iteration_start_time).total_seconds()
             
@@ -628,14 +941,17 @@ if __name__ == "__main__":
             print("✅" * 35)
             
         except KeyboardInterrupt:
+            # The feed may have been fetched without its articles being processed
+            clear_feed_state(processed_db)
             print("\n\n" + "🛑" * 35)
             print("⛔ SCRAPER STOPPED BY USER")
             print(f"📊 Total iterations completed: {iteration}")
-            print(f"📚 Total unique articles processed: {len(processed_articles)}")
+            print(f"📚 Total unique articles processed: {count_processed(processed_db)}")
             print("🛑" * 35)
             break
             
         except Exception as e:
+            clear_feed_state(processed_db)
             end_time = datetime.now()
             duration = (end_time - iteration_start_time).total_seconds()
             print("\n" + "⚠️" * 35)
@@ -651,7 +967,7 @@ if __name__ == "__main__":
         
         if sleep_seconds > 0:
             sleep_minutes = sleep_seconds / 60
-            next_run_time = datetime.now() + pd.Timedelta(seconds=sleep_seconds)
+            next_run_time = datetime.now() + timedelta(seconds=sleep_seconds)
             
             print(f"\n💤 Sleeping for {sleep_minutes:.1f} minutes...")
             print(f"⏰ Next iteration at: {next_run_time.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -659,12 +975,12 @@ if __name__ == "__main__":
             print("-" * 70 + "\n")
             
             try:
-                time.sleep(sleep_seconds)
+                loop.run_until_complete(asyncio.sleep(sleep_seconds))
             except KeyboardInterrupt:
                 print("\n\n" + "🛑" * 35)
                 print("⛔ SCRAPER STOPPED BY USER")
                 print(f"📊 Total iterations completed: {iteration}")
-                print(f"📚 Total unique articles processed: {len(processed_articles)}")
+                print(f"📚 Total unique articles processed: {count_processed(processed_db)}")
                 print("🛑" * 35)
                 break
         else:
@@ -672,3 +988,7 @@ if __name__ == "__main__":
             print(f"   (Longer than {INTERVAL_MINUTES}-minute interval!)")
             print(f"   Starting next iteration immediately...\n")
             print("-" * 70 + "\n")
+    
+    # Shut down the long-lived browser and event loop
+    loop.run_until_complete(stop_browser(playwright, browser))
+    loop.close()
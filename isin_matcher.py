@@ -12,8 +12,173 @@ if sys.platform == 'win32':
     except:
         pass
 
+import atexit
+import os
+import re
+import shelve
+import time
+from functools import lru_cache
+import ahocorasick
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz, process
+from rapidfuzz import fuzz, process, utils
+
+# Arrow-backed strings for the name column when pyarrow is available (plain 'string'
+# is Python-backed on pandas 2.x); the parquet sidecar needs pyarrow as well
+try:
+    import pyarrow  # noqa: F401
+    NAME_DTYPE = 'string[pyarrow]'
+except ImportError:
+    NAME_DTYPE = 'string'
+
+COMPANY_COLUMN = 'Company Name'
+# The only mapping columns the matcher reads; everything else in the sheet is skipped
+MAPPING_COLUMNS = [COMPANY_COLUMN, 'CD_ISIN No', 'CD_NSE Symbol', 'CD_BSE Code', 'CD_Industry1']
+PREFILTER_BUCKETS = 64  # Character-histogram width used to bound fuzzy scores
+ISIN_CACHE_FILE = 'isin_cache.db'
+ISIN_CACHE_TTL_SECONDS = 7 * 24 * 3600  # Mapping rarely changes; refresh weekly
+
+_isin_cache = None
+
+# Legal suffixes stripped to get the name as it usually appears in headlines
+LEGAL_SUFFIXES = (' limited', ' ltd.', ' ltd', ' pvt.', ' pvt', ' private', ' corporation', ' corp.', ' corp', ' inc.', ' inc', ' co.')
+MIN_ALIAS_LENGTH = 4  # Shorter aliases (e.g. "itc", "sbi") collide with ordinary words too often
+# Phrases that contain a listed company's name without being about it; text containing
+# one is always left to Gemini
+ALIAS_COLLISIONS = ('reserve bank of india', 'south indian bank', 'indian oil price')
+# Single-word aliases ("mega", "delta", "vision", "premier") are everyday words far more
+# often than company mentions, so only multi-word aliases are matched verbatim
+
+
+def _write_parquet_sidecar(df: pd.DataFrame, parquet_file: str):
+    """Write the sidecar via a temp file so an interrupted write never leaves a truncated,
+    newer-than-the-workbook file behind; failures (e.g. no parquet engine) only cost the cache"""
+    tmp_file = f"{parquet_file}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp_file)
+        os.replace(tmp_file, parquet_file)
+    except Exception as e:
+        print(f"   ⚠️  Could not write parquet mapping cache ({str(e)[:100]})")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+def _read_mapping_frame(excel_file: str) -> pd.DataFrame:
+    """
+    Mapping columns from the parquet sidecar (<file>.parquet), or from Excel when the
+    sidecar is missing, older than the workbook or unreadable. The workbook is parsed
+    at most once; the sidecar holds only MAPPING_COLUMNS, so reading it whole is the
+    projected read.
+    """
+    parquet_file = excel_file + '.parquet'
+    if os.path.exists(parquet_file) and os.path.getmtime(parquet_file) >= os.path.getmtime(excel_file):
+        try:
+            return pd.read_parquet(parquet_file)
+        except Exception as e:
+            print(f"   ⚠️  Parquet mapping cache unreadable ({str(e)[:100]}), reading Excel")
+    
+    df = pd.read_excel(excel_file, usecols=lambda c: c in MAPPING_COLUMNS)
+    _write_parquet_sidecar(df, parquet_file)
+    return df
+
+
+@lru_cache(maxsize=4)
+def _load_mapping(excel_file: str) -> tuple:
+    """
+    Read the company-ISIN mapping once per file
+    
+    Returns:
+        tuple: (unique company names, {company name: every row for that name, as dicts,
+               in sheet order}). Names listed more than once (e.g. rights entitlements)
+               are scored once. Row values of the detail columns are pre-cleaned
+               strings ('' for blanks). Both are empty if the file has no company
+               name column.
+        The result is shared between callers and must not be modified.
+    """
+    df = _read_mapping_frame(excel_file)
+    if COMPANY_COLUMN not in df.columns:
+        return [], {}
+    
+    df = df.dropna(subset=[COMPANY_COLUMN])
+    
+    # Clean the detail columns to strings once, vectorized, instead of per match
+    for column in MAPPING_COLUMNS[1:]:
+        if column not in df.columns:
+            df[column] = ''
+            continue
+        values = df[column]
+        # Numeric codes come back as floats when the column has blanks (500209.0)
+        if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+            values = values.astype('Int64')
+        df[column] = values.astype('string').fillna('')
+    
+    # NAME_DTYPE strings, deduplicated so repeated listings aren't fuzzy-scored
+    # (and ranked) more than once
+    df[COMPANY_COLUMN] = df[COMPANY_COLUMN].astype(NAME_DTYPE)
+    company_names = df[COMPANY_COLUMN].drop_duplicates().tolist()
+    
+    rows_by_name = {}
+    for row in df.to_dict('records'):
+        rows_by_name.setdefault(row[COMPANY_COLUMN], []).append(row)
+    
+    return company_names, rows_by_name
+
+
+def _sorted_tokens(name: str) -> str:
+    """The string token_sort_ratio actually compares: processed, tokens sorted, single-spaced"""
+    return ' '.join(sorted(utils.default_process(name).split()))
+
+
+def _char_histogram(text: str) -> np.ndarray:
+    """Character counts folded into PREFILTER_BUCKETS buckets (a-z, 0-9, space, rest hashed)"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    buckets = np.full(codes.shape, 37, dtype=np.int64)
+    lower = (codes >= ord('a')) & (codes <= ord('z'))
+    digit = (codes >= ord('0')) & (codes <= ord('9'))
+    buckets[lower] = codes[lower] - ord('a')
+    buckets[digit] = codes[digit] - ord('0') + 26
+    buckets[codes == ord(' ')] = 36
+    other = ~(lower | digit | (codes == ord(' ')))
+    buckets[other] = 37 + codes[other] % (PREFILTER_BUCKETS - 37)
+    return np.bincount(buckets, minlength=PREFILTER_BUCKETS).astype(np.uint16)
+
+
+@lru_cache(maxsize=4)
+def _candidate_signatures(excel_file: str) -> tuple:
+    """
+    Per-candidate (token-sorted names, lengths, char histograms) aligned with
+    _load_mapping's name list
+    
+    The token-sorted names are what token_sort_ratio would rebuild for every comparison;
+    computing them once lets matching score them with a plain Indel ratio.
+    """
+    company_names, _ = _load_mapping(excel_file)
+    processed = [_sorted_tokens(str(name)) for name in company_names]
+    lengths = np.array([len(p) for p in processed], dtype=np.int32)
+    histograms = np.vstack([_char_histogram(p) for p in processed]) if processed else np.zeros((0, PREFILTER_BUCKETS), dtype=np.uint16)
+    return processed, lengths, histograms
+
+
+def _prefilter(query: str, excel_file: str, min_score: int) -> np.ndarray:
+    """
+    Indices of candidates that can still reach min_score with token_sort_ratio
+    
+    token_sort_ratio is an Indel similarity, 200 * LCS / (len1 + len2), and the LCS is
+    at most the shared character count. Bucketing characters only raises that count,
+    so the bound never drops a real match. It also covers the length-difference bound.
+    
+    query is the already token-sorted form (_sorted_tokens) of the company name.
+    """
+    _, lengths, histograms = _candidate_signatures(excel_file)
+    if not query:
+        return np.arange(len(lengths))
+    
+    overlap = np.minimum(histograms, _char_histogram(query)).sum(axis=1)
+    upper_bound = 200.0 * overlap / (lengths + len(query))
+    # Half a point of slack so scores that RapidFuzz rounds up to min_score are kept
+    return np.flatnonzero(upper_bound >= min_score - 0.5)
 
 
 def get_isin_for_company(company_name: str, excel_file: str = 'accord_bse_mapping_original.xlsx', top_n: int = 3, min_score: int = 70) -> list:
@@ -33,6 +198,7 @@ def get_isin_for_company(company_name: str, excel_file: str = 'accord_bse_mappin
                   {
                       'matched_name': 'Tata Motors Ltd',
                       'isin': 'INE155A01022',
+                      'isins': ['INE155A01022'],  # every ISIN listed under the name
                       'nse_symbol': 'TATAMOTORS',
                       'bse_code': '500570',
                       'rank': 1,
@@ -47,52 +213,36 @@ def get_isin_for_company(company_name: str, excel_file: str = 'accord_bse_mappin
         return []
     
     try:
-        # Load the Excel file
-        df = pd.read_excel(excel_file)
-        
-        # Get list of company names from the dataframe
-        company_column = 'Company Name'
-        if company_column not in df.columns:
-            print(f"      ⚠️  '{company_column}' column not found in Excel file")
+        # Load the mapping (parsed once per file, then served from cache)
+        company_names, rows_by_name = _load_mapping(excel_file)
+        if not company_names:
+            print(f"      ⚠️  '{COMPANY_COLUMN}' column not found in Excel file")
             return []
         
-        # Create a list of company names (remove NaN values)
-        company_names = df[company_column].dropna().tolist()
+        # token_sort_ratio == Indel ratio of the token-sorted strings; candidates are
+        # token-sorted once at load, so only the query is preprocessed here
+        sorted_names = _candidate_signatures(excel_file)[0]
+        query = _sorted_tokens(company_name)
+        
+        # Cheap vectorized bound first; only survivors get the real fuzzy score
+        survivors = _prefilter(query, excel_file, min_score)
         
         # Use fuzzy matching to find top matches
-        # process.extract returns list of tuples: (match, score)
-        matches = process.extract(company_name, company_names, scorer=fuzz.token_sort_ratio, limit=top_n)
+        # process.extract returns list of tuples: (match, score, index); candidates
+        # below min_score are pruned inside RapidFuzz via score_cutoff
+        matches = process.extract(
+            query,
+            [sorted_names[i] for i in survivors],
+            scorer=fuzz.ratio,
+            processor=None,
+            limit=top_n,
+            score_cutoff=min_score
+        )
         
         results = []
-        for rank, (matched_name, score) in enumerate(matches, 1):
-            # Filter out matches below minimum score threshold
-            if score < min_score:
-                continue  # Skip this match
-            
-            # Get the row for this company
-            row = df[df[company_column] == matched_name].iloc[0]
-            
-            # Extract ISIN and other info
-            isin = row.get('CD_ISIN No', '')
-            nse_symbol = row.get('CD_NSE Symbol', '')
-            bse_code = row.get('CD_BSE Code', '')
-            industry = row.get('CD_Industry1', '')
-            
-            # Convert to string and handle NaN
-            isin = str(isin) if pd.notna(isin) else ''
-            nse_symbol = str(nse_symbol) if pd.notna(nse_symbol) else ''
-            bse_code = str(bse_code) if pd.notna(bse_code) else ''
-            industry = str(industry) if pd.notna(industry) else ''
-            
-            results.append({
-                'matched_name': matched_name,
-                'isin': isin,
-                'nse_symbol': nse_symbol,
-                'bse_code': bse_code,
-                'industry': industry,
-                'rank': rank,
-                'score': score
-            })
+        for rank, (_, score, index) in enumerate(matches, 1):
+            matched_name = company_names[survivors[index]]
+            results.append(_build_match(matched_name, rows_by_name[matched_name], rank, score))
         
         # If no results above threshold, return empty list (company_not_found)
         return results
@@ -102,6 +252,265 @@ def get_isin_for_company(company_name: str, excel_file: str = 'accord_bse_mappin
         return []
 
 
+def get_isin_for_companies_batch(company_names: list, excel_file: str = 'accord_bse_mapping_original.xlsx', top_n: int = 3, min_score: int = 70) -> dict:
+    """
+    Batch version of get_isin_for_company: scores every (query, candidate) pair in one
+    multi-threaded RapidFuzz cdist call instead of one process.extract per company
+    
+    Args:
+        company_names (list): Company names to search for (duplicates/empties ignored)
+        excel_file (str): Path to Excel file with company-ISIN mapping
+        top_n (int): Number of top matches to return per company (default: 3)
+        min_score (int): Minimum fuzzy match score to accept (default: 70)
+    
+    Returns:
+        dict: {company_name: [matches in get_isin_for_company format]}
+    """
+    
+    queries = list(dict.fromkeys(name for name in company_names if name))
+    if not queries:
+        return {}
+    
+    try:
+        company_names, rows_by_name = _load_mapping(excel_file)
+        if not company_names:
+            print(f"      ⚠️  '{COMPANY_COLUMN}' column not found in Excel file")
+            return {name: [] for name in queries}
+        
+        # Queries and candidates both token-sorted up front (see get_isin_for_company)
+        sorted_names = _candidate_signatures(excel_file)[0]
+        sorted_queries = [_sorted_tokens(name) for name in queries]
+        
+        # Only score candidates that survive the prefilter for at least one query
+        keep = np.unique(np.concatenate([_prefilter(query, excel_file, min_score) for query in sorted_queries]))
+        if len(keep) == 0:
+            return {name: [] for name in queries}
+        candidates = [company_names[i] for i in keep]
+        
+        # (n_queries, n_candidates) score matrix; below-cutoff scores are 0. Kept as float
+        # so ties rank exactly as in get_isin_for_company (the prefilter keeps it small)
+        scores = process.cdist(
+            sorted_queries,
+            [sorted_names[i] for i in keep],
+            scorer=fuzz.ratio,
+            processor=None,
+            score_cutoff=min_score,
+            dtype=np.float32,
+            workers=-1
+        )
+        
+        # k-th best score per row in one pass; everything above it plus the
+        # lowest-index ties makes the top-k, the same tie-break process.extract uses
+        k = min(top_n, len(candidates))
+        kth_scores = np.partition(scores, -k, axis=1)[:, -k]
+        
+        results = {}
+        for q, name in enumerate(queries):
+            row_scores = scores[q]
+            above = np.flatnonzero(row_scores > kth_scores[q])
+            tied = np.flatnonzero(row_scores == kth_scores[q])[:k - len(above)]
+            ranked = sorted(np.concatenate([above, tied]), key=lambda j: (-row_scores[j], j))
+            ranked = [j for j in ranked if row_scores[j] >= min_score]
+            results[name] = [
+                _build_match(candidates[j], rows_by_name[candidates[j]], rank, row_scores[j])
+                for rank, j in enumerate(ranked, 1)
+            ]
+        return results
+        
+    except Exception as e:
+        print(f"      ⚠️  Error matching ISIN: {str(e)[:100]}")
+        return {name: [] for name in queries}
+
+
+def _build_match(matched_name: str, rows: list, rank: int, score) -> dict:
+    """Format a matched name's mapping rows as a match result (details from its first row)"""
+    
+    # Values were cleaned to strings when the mapping was loaded
+    row = rows[0]
+    return {
+        'matched_name': matched_name,
+        'isin': row['CD_ISIN No'],
+        'isins': list(dict.fromkeys(r['CD_ISIN No'] for r in rows if r['CD_ISIN No'])),
+        'nse_symbol': row['CD_NSE Symbol'],
+        'bse_code': row['CD_BSE Code'],
+        'industry': row['CD_Industry1'],
+        'rank': rank,
+        'score': int(round(score))
+    }
+
+
+def _get_isin_cache():
+    """Open the on-disk ISIN cache on first use"""
+    global _isin_cache
+    if _isin_cache is None:
+        _isin_cache = shelve.open(ISIN_CACHE_FILE)
+        atexit.register(_isin_cache.close)
+    return _isin_cache
+
+
+def _norm(name: str) -> str:
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def _cache_key(company_name: str, top_n: int, min_score: int) -> str:
+    return f"{_norm(company_name)}|{top_n}|{min_score}"
+
+
+def cached_isin(company_name: str, top_n: int = 3, min_score: int = 70) -> list:
+    """
+    get_isin_for_company backed by a persistent cache keyed by the normalized company name
+    
+    Entries are stored as (timestamp, matches) and refreshed after ISIN_CACHE_TTL_SECONDS.
+    Empty results are not cached, since they may come from a transient load error.
+    """
+    
+    if not company_name:
+        return []
+    
+    cache = _get_isin_cache()
+    key = _cache_key(company_name, top_n, min_score)
+    
+    entry = cache.get(key)
+    if entry is not None:
+        cached_at, matches = entry
+        if time.time() - cached_at < ISIN_CACHE_TTL_SECONDS:
+            return matches
+    
+    matches = get_isin_for_company(company_name, top_n=top_n, min_score=min_score)
+    if matches:
+        cache[key] = (time.time(), matches)
+    return matches
+
+
+def _company_aliases(name: str) -> set:
+    """
+    Lowercase forms of a mapping name to look for in text: as listed, and without legal
+    suffixes. Only multi-word forms are kept (see MIN_ALIAS_LENGTH note above).
+    """
+    lower = ' '.join(name.lower().split())
+    stripped = lower
+    changed = True
+    while changed:
+        changed = False
+        for suffix in LEGAL_SUFFIXES:
+            if stripped.endswith(suffix):
+                stripped = stripped[:-len(suffix)].rstrip(' .,')
+                changed = True
+    return {alias for alias in (lower, stripped) if len(alias) >= MIN_ALIAS_LENGTH and ' ' in alias}
+
+
+@lru_cache(maxsize=4)
+def get_company_automaton(excel_file: str = 'accord_bse_mapping_original.xlsx'):
+    """Aho-Corasick automaton over every company alias in the mapping, built once per file"""
+    _, rows_by_name = _load_mapping(excel_file)
+    
+    automaton = ahocorasick.Automaton()
+    for name, rows in rows_by_name.items():
+        # Rows without an ISIN are indices and other non-tradeable entries (e.g. "NIFTY 50")
+        if not any(row['CD_ISIN No'] for row in rows):
+            continue
+        name = str(name)
+        for alias in _company_aliases(name):
+            if alias not in automaton:
+                automaton.add_word(alias, (alias, name))
+    automaton.make_automaton()
+    return automaton
+
+
+def find_company_in_text(text: str, excel_file: str = 'accord_bse_mapping_original.xlsx') -> str:
+    """
+    Find a known company mentioned verbatim in text with a single Aho-Corasick pass
+    
+    Only whole-word matches count; when several companies match, the one mentioned
+    first wins (the longest alias among those starting at the same position). No
+    company is returned if the text contains a known collision (ALIAS_COLLISIONS) or
+    if the first match follows a capitalised word, i.e. sits inside a longer proper
+    noun ("Reserve Bank of India", "South Indian Bank"); the caller then asks Gemini.
+    
+    Returns:
+        str: Company name as listed in the mapping, or empty string if none found
+    """
+    
+    if not text:
+        return ""
+    
+    try:
+        automaton = get_company_automaton(excel_file)
+    except Exception as e:
+        print(f"      ⚠️  Error building company matcher: {str(e)[:100]}")
+        return ""
+    
+    if len(automaton) == 0:
+        return ""
+    
+    text_lower = text.lower()
+    # Offsets must line up with the original text for the capitalisation check
+    if len(text_lower) != len(text) or any(phrase in text_lower for phrase in ALIAS_COLLISIONS):
+        return ""
+    
+    best_start, best_alias, best_name = len(text_lower), "", ""
+    for end, (alias, name) in automaton.iter(text_lower):
+        start = end - len(alias) + 1
+        if start > 0 and text_lower[start - 1].isalnum():
+            continue
+        if end + 1 < len(text_lower) and text_lower[end + 1].isalnum():
+            continue
+        if (start, -len(alias)) < (best_start, -len(best_alias)):
+            best_start, best_alias, best_name = start, alias, name
+    
+    if best_name and _continues_proper_noun(text, best_start):
+        return ""
+    return best_name
+
+
+def _continues_proper_noun(text: str, start: int) -> bool:
+    """True if the word right before text[start:] is capitalised (no punctuation in between)"""
+    preceding = text[:start].split()
+    if not preceding:
+        return False
+    word = preceding[-1]
+    return word[0].isupper() and word[-1].isalnum()
+
+
+def find_company_in_title(title: str, excel_file: str = 'accord_bse_mapping_original.xlsx') -> str:
+    """
+    find_company_in_text on a Google News title without its trailing " - <source>",
+    so a story published by a listed company (e.g. "... - Angel One") isn't attributed to it
+    """
+    headline = title.rsplit(' - ', 1)[0] if title and ' - ' in title else title
+    return find_company_in_text(headline, excel_file)
+
+
+def cached_isin_batch(company_names: list, top_n: int = 3, min_score: int = 70) -> dict:
+    """
+    Batch version of cached_isin: cache hits are served directly and all misses are
+    matched together with get_isin_for_companies_batch
+    
+    Returns:
+        dict: {company_name: matches}
+    """
+    
+    cache = _get_isin_cache()
+    now = time.time()
+    results = {}
+    misses = []
+    
+    for name in dict.fromkeys(name for name in company_names if name):
+        entry = cache.get(_cache_key(name, top_n, min_score))
+        if entry is not None and now - entry[0] < ISIN_CACHE_TTL_SECONDS:
+            results[name] = entry[1]
+        else:
+            misses.append(name)
+    
+    if misses:
+        for name, matches in get_isin_for_companies_batch(misses, top_n=top_n, min_score=min_score).items():
+            if matches:
+                cache[_cache_key(name, top_n, min_score)] = (now, matches)
+            results[name] = matches
+    
+    return results
+
+
 # Test function
 if __name__ == "__main__":
     print("=" * 70)
@@ -11,13 +11,27 @@ if sys.platform == 'win32':
     except:
         pass
 
+import asyncio
+import atexit
+import hashlib
+import shelve
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
 import google.generativeai as genai
+from google.generativeai import caching
 import json
+import logging
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Child of the scraper's logger, so pipeline runs share its handler
+logger = logging.getLogger('scraper.prompts')
+
 # Configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
@@ -25,14 +39,213 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
+GEMINI_MODEL = 'models/gemini-2.5-flash'
+
+# Characters of article text sent to Gemini per article
+PROMPT_CHARS = 4000
+# Longer texts are cut back to the last sentence end, unless that would keep fewer chars
+MIN_SENTENCE_CUT = 2000
+
+# Simultaneous Gemini requests when summarizing a batch
+MAX_CONCURRENT_SUMMARIES = 10
+
+# Lifetime of explicit Gemini context caches; recreated shortly before expiry
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Gemini refuses explicit context caches smaller than this (2.5 Flash)
+MIN_CACHE_TOKENS = 1024
+
+# (system instruction, generation config) -> (model, refresh-after timestamp). Models
+# are built once and shared by every call and thread until their context cache is due
+# for renewal; the lock keeps concurrent first calls from each creating a cache
+_cached_models = {}
+_cached_models_lock = threading.Lock()
+# Instructions measured below MIN_CACHE_TOKENS; they never get an explicit cache
+_uncacheable_instructions = set()
+
+# Validated Gemini answers keyed by content hash, so re-seen articles skip the API
+RESPONSE_CACHE_FILE = 'gemini_cache.db'
+_response_cache = None
+_response_cache_lock = threading.Lock()  # shelve is not safe for concurrent threads
+
+SUMMARY_SYSTEM_INSTRUCTION = """You are a financial data analyst. Analyze the news article you are given and extract key information.
+
+Your task:
+1. Write a concise summary (4-5 lines MAX) focusing on the most significant information
+2. Identify ALL numeric/quantitative data (revenue, profits, percentages, growth rates, market share, dates, projections, etc.)
+3. Identify the source of the data (company announcement, analyst report, regulatory filing, unnamed sources, etc.)
+
+Important:
+- List each numeric fact as a short "Label: value" string (e.g. "Revenue: ₹X crore", "Growth: X%")
+- If no numeric data found, return an empty list
+- If source unclear, say "Article/Report" or "Unnamed sources"
+"""
+
+# Structured output: Gemini returns JSON matching this schema, so the answer is
+# parsed with a plain json.loads
+SUMMARY_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "numeric_data": {"type": "array", "items": {"type": "string"}},
+        "source": {"type": "string"},
+    },
+    "required": ["summary", "numeric_data", "source"],
+}
 
-def summarize_article_data(article_text: str, article_title: str = "", company_name: str = "") -> dict:
+SUMMARY_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": SUMMARY_RESPONSE_SCHEMA,
+}
+
+
+@dataclass(slots=True)
+class ArticleView:
+    """An article's text with the lowercased and prompt-truncated forms materialized once"""
+    text: str
+    title: str = ""
+    text_lower: str = field(init=False)
+    prompt_body: str = field(init=False)
+    
+    def __post_init__(self):
+        self.text = self.text or ""
+        self.title = self.title or ""
+        self.text_lower = self.text.lower()
+        self.prompt_body = truncate_at_sentence(self.text, PROMPT_CHARS)
+    
+    @classmethod
+    def from_article(cls, article: dict) -> "ArticleView":
+        """View over a scraped article dict ('full_article', 'title')"""
+        return cls(article.get('full_article', ''), article.get('title', ''))
+
+
+def truncate_at_sentence(text: str, limit: int) -> str:
+    """
+    text[:limit], cut back to the last sentence end so the prompt doesn't stop mid-sentence
+    
+    Sentence ends are ". ", the Devanagari danda (Hindi news) and blank lines. If the last
+    one falls before MIN_SENTENCE_CUT, the plain slice is kept instead.
+    """
+    if len(text) <= limit:
+        return text
+    body = text[:limit]
+    last_stop = max(body.rfind('. '), body.rfind('।'), body.rfind('\n\n'))
+    if last_stop > MIN_SENTENCE_CUT:
+        body = body[:last_stop + 1]
+    return body
+
+
+def as_article_view(article, article_title: str = "") -> ArticleView:
+    """Accept either an ArticleView or raw article text (plus title)"""
+    return article if isinstance(article, ArticleView) else ArticleView(article, article_title)
+
+
+def get_cached_model(system_instruction: str, generation_config: dict = None):
+    """
+    GenerativeModel whose invariant system instruction is stored as Gemini cached content
+    
+    The cache is created once and reused by every call until shortly before its TTL
+    expires. Gemini refuses explicit caches below MIN_CACHE_TOKENS, so the instruction
+    is measured once with count_tokens and smaller ones skip the create call for good.
+    Those (and any instruction whose cache creation fails, which is logged and retried
+    after the TTL) get a plain model with the same system instruction, which still keeps
+    the prefix identical across calls for Gemini's implicit caching.
+    
+    Args:
+        system_instruction (str): Invariant instructions (rules, schema)
+        generation_config (dict): Optional generation settings
+    
+    Returns:
+        genai.GenerativeModel
+    """
+    
+    key = (system_instruction, repr(generation_config))
+    entry = _cached_models.get(key)
+    if entry is not None and time.time() < entry[1]:
+        return entry[0]
+    
+    with _cached_models_lock:
+        # Another thread may have built it while this one waited
+        entry = _cached_models.get(key)
+        if entry is not None and time.time() < entry[1]:
+            return entry[0]
+        
+        model = None
+        if system_instruction not in _uncacheable_instructions:
+            try:
+                tokens = genai.GenerativeModel(GEMINI_MODEL).count_tokens(system_instruction).total_tokens
+                if tokens < MIN_CACHE_TOKENS:
+                    logger.debug(f"System instruction has {tokens} tokens, below the {MIN_CACHE_TOKENS}-token context cache minimum")
+                    _uncacheable_instructions.add(system_instruction)
+                else:
+                    cached = caching.CachedContent.create(
+                        model=GEMINI_MODEL,
+                        system_instruction=system_instruction,
+                        ttl=timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS)
+                    )
+                    model = genai.GenerativeModel.from_cached_content(cached, generation_config=generation_config)
+                    refresh_at = time.time() + CONTEXT_CACHE_TTL_SECONDS - 60
+            except Exception as e:
+                logger.warning(f"⚠️  Gemini context caching unavailable, using plain system instruction: {str(e)[:100]}")
+        
+        if model is None:
+            model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=system_instruction, generation_config=generation_config)
+            if system_instruction in _uncacheable_instructions:
+                refresh_at = float('inf')  # Nothing to renew
+            else:
+                refresh_at = time.time() + CONTEXT_CACHE_TTL_SECONDS  # Retry explicit caching later
+        
+        _cached_models[key] = (model, refresh_at)
+    return model
+
+
+def _get_response_cache():
+    """Open the on-disk response cache on first use"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = shelve.open(RESPONSE_CACHE_FILE)
+            atexit.register(_response_cache.close)
+    return _response_cache
+
+
+def response_cache_key(system_instruction: str, *fields: str) -> str:
+    """
+    sha256 over the model id, the instruction text (so prompt edits act as a version
+    bump) and the request fields, each length-prefixed so field boundaries can't collide
+    """
+    h = hashlib.sha256()
+    for part in (GEMINI_MODEL, system_instruction, *fields):
+        data = part.encode('utf-8')
+        h.update(len(data).to_bytes(8, 'big'))
+        h.update(data)
+    return h.hexdigest()
+
+
+def get_cached_response(key: str, expected_type: type):
+    """Cached answer for key, or None on a miss or an entry of an outdated shape"""
+    cache = _get_response_cache()
+    try:
+        with _response_cache_lock:
+            value = cache.get(key)
+    except Exception:
+        return None
+    return value if isinstance(value, expected_type) else None
+
+
+def put_cached_response(key: str, value):
+    """Store a validated answer (callers never store error fallbacks)"""
+    cache = _get_response_cache()
+    with _response_cache_lock:
+        cache[key] = value
+
+
+def summarize_article_data(article, article_title: str = "", company_name: str = "") -> dict:
     """
     Extract significant data and source information from a news article using Gemini
     
     Args:
-        article_text (str): Full news article text
-        article_title (str): Article title (optional)
+        article (ArticleView | str): Article view, or the full news article text
+        article_title (str): Article title (optional, used with raw text)
         company_name (str): Company name identified (optional)
     
     Returns:
@@ -49,97 +262,112 @@ def summarize_article_data(article_text: str, article_title: str = "", company_n
     """
     
     if not GEMINI_API_KEY:
-        print("⚠️  GEMINI_API_KEY not found in .env file")
-        return {
-            "summary": "API key not configured",
-            "numeric_data": [],
-            "source": "Unknown"
-        }
+        logger.warning("⚠️  GEMINI_API_KEY not found in .env file")
+        return _empty_summary("API key not configured")
     
-    # Initialize model
-    model = genai.GenerativeModel('models/gemini-2.5-flash')
+    view = as_article_view(article, article_title)
+    cache_key = response_cache_key(SUMMARY_SYSTEM_INSTRUCTION, view.prompt_body, view.title, company_name or "")
+    cached = _get_cached_summary(cache_key)
+    if cached is not None:
+        return cached
     
-    # Create prompt
-    company_context = f" about {company_name}" if company_name else ""
+    # Model carrying the cached summarization instructions
+    model = get_cached_model(SUMMARY_SYSTEM_INSTRUCTION, SUMMARY_GENERATION_CONFIG)
     
-    prompt = f"""You are a financial data analyst. Analyze this news article{company_context} and extract key information.
+    try:
+        # Get response from Gemini
+        response = model.generate_content(_build_summary_prompt(view, company_name))
+        result = _parse_summary_response(response.text)
+        put_cached_response(cache_key, result)
+        return result
+        
+    except Exception as e:
+        logger.warning(f"Error summarizing article: {e}")
+        return _empty_summary("Error processing article")
+
 
-Article Title: {article_title or "Not provided"}
+async def summarize_article_data_async(article, article_title: str = "", company_name: str = "") -> dict:
+    """
+    Async version of summarize_article_data using Gemini's async client, so several
+    articles can be summarized concurrently
+    
+    Args / Returns: same as summarize_article_data
+    """
+    
+    if not GEMINI_API_KEY:
+        logger.warning("⚠️  GEMINI_API_KEY not found in .env file")
+        return _empty_summary("API key not configured")
+    
+    view = as_article_view(article, article_title)
+    cache_key = response_cache_key(SUMMARY_SYSTEM_INSTRUCTION, view.prompt_body, view.title, company_name or "")
+    cached = _get_cached_summary(cache_key)
+    if cached is not None:
+        return cached
+    
+    model = get_cached_model(SUMMARY_SYSTEM_INSTRUCTION, SUMMARY_GENERATION_CONFIG)
+    
+    try:
+        response = await model.generate_content_async(_build_summary_prompt(view, company_name))
+        result = _parse_summary_response(response.text)
+        put_cached_response(cache_key, result)
+        return result
+        
+    except Exception as e:
+        logger.warning(f"Error summarizing article: {e}")
+        return _empty_summary("Error processing article")
 
-Article Text: {article_text[:4000]}
 
-Your task:
-1. Write a concise summary (4-5 lines MAX) focusing on the most significant information
-2. Identify ALL numeric/quantitative data (revenue, profits, percentages, growth rates, market share, dates, projections, etc.)
-3. Identify the source of the data (company announcement, analyst report, regulatory filing, unnamed sources, etc.)
+def _build_summary_prompt(view: ArticleView, company_name: str) -> str:
+    """Per-article part of the prompt, shared by the sync and async summarizers"""
+    company_line = f"Company: {company_name}\n\n" if company_name else ""
+    
+    return f"""{company_line}Article Title: {view.title or "Not provided"}
 
-Return your response as a JSON object with this EXACT format:
-{{
-    "summary": "4-5 line concise summary with key highlights and numeric data",
-    "numeric_data": [
-        "Revenue: ₹X crore",
-        "Growth: X%",
-        "Other numeric fact"
-    ],
-    "source": "Where this data is coming from (company, analyst, filing, etc.)"
-}}
+Article Text: {view.prompt_body}"""
 
-Important:
-- Keep summary to 4-5 lines maximum
-- Extract ALL significant numbers mentioned
-- Be specific about the source
-- If no numeric data found, return empty array
-- If source unclear, say "Article/Report" or "Unnamed sources"
 
-JSON Response:"""
+def _parse_summary_response(response_text: str) -> dict:
+    """Parse the model's schema-constrained JSON answer into the summary dict"""
+    result = json.loads(response_text)
     
-    try:
-        # Get response from Gemini
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # Try to extract JSON
-        if '```json' in response_text:
-            json_str = response_text.split('```json')[1].split('```')[0].strip()
-        elif '```' in response_text:
-            json_str = response_text.split('```')[1].split('```')[0].strip()
-        elif '{' in response_text:
-            # Find JSON in response
-            start = response_text.find('{')
-            end = response_text.rfind('}') + 1
-            json_str = response_text[start:end]
-        else:
-            json_str = response_text
-        
-        # Parse JSON
-        result = json.loads(json_str)
-        
-        # Validate structure
-        if not isinstance(result, dict):
-            raise ValueError("Response is not a dictionary")
-        
-        # Ensure all keys exist
-        return {
-            "summary": result.get('summary', 'No summary available'),
-            "numeric_data": result.get('numeric_data', []),
-            "source": result.get('source', 'Unknown')
-        }
-        
-    except Exception as e:
-        print(f"Error summarizing article: {e}")
-        return {
-            "summary": "Error processing article",
-            "numeric_data": [],
-            "source": "Unknown"
-        }
+    # Validate structure
+    if not isinstance(result, dict):
+        raise ValueError("Response is not a dictionary")
+    
+    # Ensure all keys exist
+    return {
+        "summary": result.get('summary', 'No summary available'),
+        "numeric_data": result.get('numeric_data', []),
+        "source": result.get('source', 'Unknown')
+    }
 
 
-def summarize_multiple_articles(articles: list) -> list:
+def _get_cached_summary(cache_key: str):
+    """Cached summary dict, ignoring entries that predate the current schema"""
+    cached = get_cached_response(cache_key, dict)
+    if cached is not None and {'summary', 'numeric_data', 'source'} <= cached.keys():
+        return cached
+    return None
+
+
+def _empty_summary(summary: str) -> dict:
+    return {
+        "summary": summary,
+        "numeric_data": [],
+        "source": "Unknown"
+    }
+
+
+def summarize_multiple_articles(articles: list, max_workers: int = MAX_CONCURRENT_SUMMARIES) -> list:
     """
     Summarize multiple articles with their data extraction
     
+    Synchronous version for callers without an event loop: the blocking Gemini calls
+    run on a thread pool (network waits release the GIL), at most max_workers at a time.
+    
     Args:
         articles (list): List of article dictionaries with 'full_article', 'title', 'company_name'
+        max_workers (int): Upper bound on simultaneous Gemini requests
     
     Returns:
         list: List of articles with added 'ai_summary' field containing extracted data
@@ -148,28 +376,75 @@ def summarize_multiple_articles(articles: list) -> list:
     if not articles:
         return []
     
-    print(f"\n📊 Summarizing {len(articles)} articles with AI...\n")
+    logger.info(f"\n📊 Summarizing {len(articles)} articles with AI...\n")
+    
+    eligible = _eligible_for_summary(articles)
     
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = list(executor.map(
+            lambda article: summarize_article_data(
+                ArticleView.from_article(article),
+                company_name=article.get('company_name', '')
+            ),
+            [article for _, article in eligible]
+        ))
+    
+    return _attach_summaries(eligible, summaries, len(articles))
+
+
+async def summarize_multiple_articles_async(articles: list, max_concurrency: int = MAX_CONCURRENT_SUMMARIES) -> list:
+    """
+    Summarize multiple articles concurrently (at most max_concurrency Gemini calls in flight)
+    
+    Args:
+        articles (list): List of article dictionaries with 'full_article', 'title', 'company_name'
+        max_concurrency (int): Upper bound on simultaneous Gemini requests
+    
+    Returns:
+        list: List of articles with added 'ai_summary' field, in input order
+    """
+    
+    if not articles:
+        return []
+    
+    logger.info(f"\n📊 Summarizing {len(articles)} articles with AI...\n")
+    
+    eligible = _eligible_for_summary(articles)
+    
+    sem = asyncio.Semaphore(max_concurrency)
+    
+    async def _summarize(article):
+        async with sem:
+            return await summarize_article_data_async(
+                ArticleView.from_article(article),
+                company_name=article.get('company_name', '')
+            )
+    
+    summaries = await asyncio.gather(*[_summarize(article) for _, article in eligible])
+    
+    return _attach_summaries(eligible, summaries, len(articles))
+
+
+def _eligible_for_summary(articles: list) -> list:
+    """(1-based position, article) pairs worth sending to Gemini"""
+    # Skip if article is too short or has errors
+    return [
+        (i, article) for i, article in enumerate(articles, 1)
+        if article.get('article_length', 0) >= 200
+        and not article.get('full_article', '').startswith('ERROR')
+        and not article.get('full_article', '').startswith('NO_CONTENT')
+    ]
+
+
+def _attach_summaries(eligible: list, summaries: list, total: int) -> list:
+    """Copy each eligible article with its 'ai_summary', reporting progress in input order"""
     summarized_articles = []
+    lines = []  # Progress report, logged once for the whole batch
     
-    for i, article in enumerate(articles, 1):
-        article_text = article.get('full_article', '')
-        article_title = article.get('title', '')
-        company_name = article.get('company_name', '')
-        
-        # Skip if article is too short or has errors
-        if article.get('article_length', 0) < 200:
-            continue
-        
-        if article_text.startswith('ERROR') or article_text.startswith('NO_CONTENT'):
-            continue
-        
-        print(f"   [{i}/{len(articles)}] Analyzing: {article.get('source', 'Unknown')}")
-        if company_name:
-            print(f"      Company: {company_name}")
-        
-        # Get AI summary
-        ai_summary = summarize_article_data(article_text, article_title, company_name)
+    for (i, article), ai_summary in zip(eligible, summaries):
+        lines.append(f"   [{i}/{total}] Analyzing: {article.get('source', 'Unknown')}")
+        if article.get('company_name', ''):
+            lines.append(f"      Company: {article['company_name']}")
         
         # Add summary to article
         article_with_summary = article.copy()
@@ -177,10 +452,13 @@ def summarize_multiple_articles(articles: list) -> list:
         summarized_articles.append(article_with_summary)
         
         # Show preview
-        print(f"      ✅ Summary: {ai_summary['summary'][:80]}...")
+        lines.append(f"      ✅ Summary: {ai_summary['summary'][:80]}...")
         if ai_summary['numeric_data']:
-            print(f"      📊 Found {len(ai_summary['numeric_data'])} numeric data points")
-        print()
+            lines.append(f"      📊 Found {len(ai_summary['numeric_data'])} numeric data points")
+        lines.append("")
+    
+    if lines:
+        logger.info("\n".join(lines))
     
     return summarized_articles
 
@@ -197,56 +475,62 @@ def print_summary_results(articles_with_summaries: list):
         print("\n⚠️  No summarized articles to display")
         return
     
-    print("\n" + "=" * 70)
-    print("📰 AI-GENERATED ARTICLE SUMMARIES")
-    print("=" * 70)
+    out = []
+    
+    out.append("\n" + "=" * 70)
+    out.append("📰 AI-GENERATED ARTICLE SUMMARIES")
+    out.append("=" * 70)
     
     for i, article in enumerate(articles_with_summaries, 1):
         ai_summary = article.get('ai_summary', {})
         
-        print(f"\n{'─' * 70}")
-        print(f"📄 Article #{i}: {article.get('source', 'Unknown')}")
-        print(f"{'─' * 70}")
+        out.append(f"\n{'─' * 70}")
+        out.append(f"📄 Article #{i}: {article.get('source', 'Unknown')}")
+        out.append(f"{'─' * 70}")
         
         # Company
         if article.get('company_name'):
-            print(f"🏢 Company: {article['company_name']}")
+            out.append(f"🏢 Company: {article['company_name']}")
         
         # Title
-        print(f"📌 Title: {article.get('title', 'No title')}")
+        out.append(f"📌 Title: {article.get('title', 'No title')}")
         
         # Summary
-        print(f"\n📝 Summary:")
+        out.append("\n📝 Summary:")
         summary_lines = ai_summary.get('summary', 'No summary').split('\n')
         for line in summary_lines:
             if line.strip():
-                print(f"   {line.strip()}")
+                out.append(f"   {line.strip()}")
         
         # Numeric Data
         numeric_data = ai_summary.get('numeric_data', [])
         if numeric_data:
-            print(f"\n📊 Key Numeric Data:")
+            out.append("\n📊 Key Numeric Data:")
             for data_point in numeric_data:
-                print(f"   • {data_point}")
+                out.append(f"   • {data_point}")
         
         # Source
         source = ai_summary.get('source', 'Unknown')
-        print(f"\n🔗 Data Source: {source}")
+        out.append(f"\n🔗 Data Source: {source}")
         
         # URL
-        print(f"🌐 URL: {article.get('url', 'N/A')[:70]}...")
+        out.append(f"🌐 URL: {article.get('url', 'N/A')[:70]}...")
     
-    print("\n" + "=" * 70)
+    out.append("\n" + "=" * 70)
     
     # Statistics
     total_numeric_points = sum(len(a.get('ai_summary', {}).get('numeric_data', [])) for a in articles_with_summaries)
     articles_with_numbers = sum(1 for a in articles_with_summaries if a.get('ai_summary', {}).get('numeric_data', []))
     
-    print("📊 SUMMARY STATISTICS:")
-    print(f"   Total articles summarized: {len(articles_with_summaries)}")
-    print(f"   Articles with numeric data: {articles_with_numbers}")
-    print(f"   Total numeric data points: {total_numeric_points}")
-    print("=" * 70)
+    out.append("📊 SUMMARY STATISTICS:")
+    out.append(f"   Total articles summarized: {len(articles_with_summaries)}")
+    out.append(f"   Articles with numeric data: {articles_with_numbers}")
+    out.append(f"   Total numeric data points: {total_numeric_points}")
+    out.append("=" * 70)
+    
+    # One write for the whole report instead of a flush per line
+    sys.stdout.write("\n".join(out) + "\n")
+    sys.stdout.flush()
 
 
 # Example usage
@@ -303,5 +587,6 @@ def main():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     main()
 